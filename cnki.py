@@ -3,26 +3,60 @@ from dataclasses import dataclass
 from datetime import date
 from pathlib import Path
 from typing import Generator, Iterable, Optional, List, ContextManager, Dict, Tuple
-from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from urllib.parse import unquote, urljoin, urlsplit, parse_qsl
 import uuid
 from itertools import chain, count
 import re
-import json
+import time
 from math import ceil
 
+from bs4 import BeautifulSoup, Tag
+from requests import RequestException, Session
 from selenium.common.exceptions import (
     NoSuchElementException,
     StaleElementReferenceException,
     TimeoutException,
     WebDriverException,
 )
-from selenium.webdriver import Firefox
+from selenium.webdriver import Firefox, FirefoxOptions
 from selenium.webdriver.common.by import By
+from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
+import deadline
+import transport
+from writers import write_articles
+
+MAX_PAGES = 10  # CNKI only serves the first 500 results.
+
+# Firefox preferences that stop the browser from fetching anything but the
+# documents themselves: images, stylesheets, web fonts and media.
+BLOCKED_RESOURCE_PREFS = {
+    'permissions.default.image': 2,
+    'permissions.default.stylesheet': 2,
+    'browser.display.use_document_fonts': 0,
+    'gfx.downloadable_fonts.enabled': False,
+    'media.autoplay.default': 5,
+    'media.play-stand-alone': False,
+}
+
+
+def soup_text(tag: Tag) -> str:
+    "Text of ``tag`` with whitespace collapsed, as Selenium's ``.text`` gives it."
+    return ' '.join(tag.get_text().split())
+
+
+def row_number(row: Tag) -> int:
+    "The running number of a grid row, counted across all result pages."
+    number = row.find('td')
+    dl_links, sno = number.find_all('a')
+    return int(soup_text(sno))
+
 
 @dataclass
 class Result:
@@ -41,36 +75,73 @@ class Result:
         number, title, author, source, published, database = row.find_elements_by_xpath('td')
 
         title_links = title.find_elements_by_tag_name('a')
+        dl_links, sno = number.find_elements_by_tag_name('a')
+
+        return cls.from_cells(
+            title_links=[(a.text, a.get_attribute('href')) for a in title_links],
+            dl_link=dl_links.get_attribute('href'),
+            author=author.text,
+            source=source.text,
+            source_link=source.get_attribute('href'),
+            published=published.text,
+            database=database.text,
+        )
+
+    @classmethod
+    def from_soup_row(cls, row: Tag, page_url: str) -> 'Result':
+        """Same as from_row, for a grid row fetched over plain HTTP."""
+        number, title, author, source, published, database = row.find_all('td', recursive=False)
+
+        def href(tag: Tag) -> Optional[str]:
+            return urljoin(page_url, tag['href']) if tag.get('href') else None
+
+        title_links = title.find_all('a')
+        dl_links, sno = number.find_all('a')
+
+        return cls.from_cells(
+            title_links=[(soup_text(a), href(a)) for a in title_links],
+            dl_link=href(dl_links),
+            author=soup_text(author),
+            source=soup_text(source),
+            source_link=href(source),
+            published=soup_text(published),
+            database=soup_text(database),
+        )
 
+    @classmethod
+    def from_cells(
+        cls,
+        title_links: List[Tuple[str, str]],  # (text, href) of each anchor in the title cell
+        dl_link: str,
+        author: str,
+        source: str,
+        source_link: Optional[str],
+        published: str,
+        database: str,
+    ) -> 'Result':
         if len(title_links) > 1:
             # 'http://big5.oversea.cnki.net/kns55/ReadRedirectPage.aspx?flag=html&domain=http%3a%2f%2fkns.cnki.net%2fKXReader%2fDetail%3fdbcode%3dCJFD%26filename%3dZDXB202006009'
-            html_link = unquote(
-                title_links[1]
-                    .get_attribute('href')
-                    .split('domain=', 1)[1])
+            html_link = unquote(title_links[1][1].split('domain=', 1)[1])
         else:
             html_link = None
 
-        dl_links, sno = number.find_elements_by_tag_name('a')
-        dl_links = dl_links.get_attribute('href')
-
-        if re.search("javascript:alert.+", dl_links):
-            dl_links = None
+        if re.search("javascript:alert.+", dl_link):
+            dl_link = None
 
         published_date = date.fromisoformat(
-            published.text.split(maxsplit=1)[0]
+            published.split(maxsplit=1)[0]
         )
 
         return cls(
-            title=title_links[0].text,
-            title_link=title_links[0].get_attribute('href'),
+            title=title_links[0][0],
+            title_link=title_links[0][1],
             html_link=html_link,
-            author=author.text,
-            source=source.text,
-            source_link=source.get_attribute('href'),
+            author=author,
+            source=source,
+            source_link=source_link,
             date=published_date,
-            download=dl_links,
-            database=database.text,
+            download=dl_link,
+            database=database,
         )
 
     def __str__(self):
@@ -135,7 +206,7 @@ class MainPage:
         self.driver = driver
 
     def submit_search(self, keyword: str) -> None:
-        wait = WebDriverWait(self.driver, 50)
+        wait = WebDriverWait(self.driver, deadline.timeout(50))
         search = wait.until(
             EC.presence_of_element_located((By.NAME, 'txt_1_value1'))
         )
@@ -143,7 +214,7 @@ class MainPage:
         search.submit()
 
     def switch_to_frame(self) -> None:
-        wait = WebDriverWait(self.driver, 100)
+        wait = WebDriverWait(self.driver, deadline.timeout(100))
         wait.until(
             EC.presence_of_element_located((By.XPATH, '//iframe[@name="iframeResult"]'))
         )
@@ -155,12 +226,23 @@ class MainPage:
         )
 
     def max_content(self) -> None:
-        """Maximize the number of items on display in the search results."""
+        """Maximize the number of items on display in the search results.
+
+        The click reloads the grid; wait for the old one to go stale so that
+        nothing reads the 20-row grid it replaces.
+        """
+        grid = self.driver.find_element(By.XPATH, '//table[@class="GridTableContent"]')
         max_content = self.driver.find_element(
             By.CSS_SELECTOR, '#id_grid_display_num > a:nth-child(3)',
         )
         max_content.click()
 
+        wait = WebDriverWait(self.driver, deadline.timeout(30))
+        wait.until(EC.staleness_of(grid))
+        wait.until(
+            EC.presence_of_element_located((By.XPATH, '//table[@class="GridTableContent"]'))
+        )
+
     # def get_element_and_stop_page(self, *locator) -> WebElement:
     #     ignored_exceptions = (NoSuchElementException, StaleElementReferenceException)
     #     wait = WebDriverWait(self.driver, 30, ignored_exceptions=ignored_exceptions)
@@ -199,7 +281,7 @@ class SearchResults:
 
     def get_element_and_stop_page(self, *locator) -> WebElement:
         ignored_exceptions = (NoSuchElementException, StaleElementReferenceException)
-        wait = WebDriverWait(self.driver, 30, ignored_exceptions=ignored_exceptions)
+        wait = WebDriverWait(self.driver, deadline.timeout(30), ignored_exceptions=ignored_exceptions)
         elm = wait.until(EC.presence_of_element_located(locator))
         self.driver.execute_script("window.stop();")
         return elm
@@ -211,10 +293,62 @@ class SearchResults:
             link.click()
             print("Navigating to Next Page")
         except (TimeoutException, WebDriverException):
+            if deadline.current().expired():
+                raise
             print("Last page reached")
 
+    def next_page_fast(self, timeout: float = 30) -> Optional[float]:
+        """Click "下頁" and wait for the old result grid to be replaced.
+
+        Returns the latency of the page transition in seconds, or None if the
+        last page has been reached.
+        """
+        grid = self.driver.find_element(By.XPATH, '//table[@class="GridTableContent"]')
 
-def loop_through_results(driver) -> Iterable[SearchResults]:
+        try:
+            link = self.driver.find_element(By.LINK_TEXT, "下頁")
+        except NoSuchElementException:
+            print("Last page reached")
+            return None
+
+        start = time.perf_counter()
+        try:
+            link.click()
+            wait = WebDriverWait(self.driver, deadline.timeout(timeout))
+            wait.until(EC.staleness_of(grid))
+            wait.until(
+                EC.presence_of_element_located((By.XPATH, '//table[@class="GridTableContent"]'))
+            )
+        except (TimeoutException, WebDriverException):
+            # Running out of time is not the end of the results.
+            if deadline.current().expired():
+                raise
+            print("Last page reached")
+            return None
+
+        latency = time.perf_counter() - start
+        print(f"Navigated to next page in {latency:.2f}s")
+        return latency
+
+
+def fast_firefox(page_load_strategy: str = 'eager') -> Firefox:
+    """Start a headless Firefox which only loads documents.
+
+    ``page_load_strategy`` is either 'eager' (return once the DOM is ready) or
+    'none' (return immediately and rely on explicit waits).
+    """
+    options = FirefoxOptions()
+    options.headless = True
+    for name, value in BLOCKED_RESOURCE_PREFS.items():
+        options.set_preference(name, value)
+
+    capabilities = DesiredCapabilities.FIREFOX.copy()
+    capabilities['pageLoadStrategy'] = page_load_strategy
+
+    return Firefox(options=options, capabilities=capabilities)
+
+
+def loop_through_results(driver, fast: bool = False) -> Iterable[SearchResults]:
     "Iterate through each page of the search result."
     result_page = SearchResults(driver)
     n_articles, n_pages = result_page.number_of_articles_and_pages()
@@ -229,28 +363,149 @@ def loop_through_results(driver) -> Iterable[SearchResults]:
         result = result_page.get_structured_elements()
         yield from result
 
-        if page >= n_pages or page >= 10:
+        if page >= n_pages or page >= MAX_PAGES:
             break
 
-        result_page.next_page()
+        if fast:
+            if result_page.next_page_fast() is None:
+                break
+        else:
+            result_page.next_page()
         result_page = SearchResults(driver)
 
 
-def save_articles(articles: Iterable[SearchResults], file_prefix: str) -> None:
-    file_path = Path(file_prefix).with_suffix('.json')
+class GridRequestRejected(Exception):
+    """The server did not answer a result grid request with a result grid."""
 
-    with file_path.open('w') as file:
-        file.write('[\n')
-        first = True
 
-        for article in articles:
-            if first:
-                first = False
-            else:
-                file.write(',\n')
-            json.dump(article.as_dict(), file, ensure_ascii=False, indent=4)
+def grid_request(driver: WebDriver) -> Tuple[str, Dict[str, str]]:
+    """Capture the URL and query parameters behind the "下頁" link.
 
-        file.write('\n]\n')
+    The driver must be switched to the ``iframeResult`` frame.
+    """
+    wait = WebDriverWait(driver, deadline.timeout(30))
+    link = wait.until(EC.presence_of_element_located((By.LINK_TEXT, "下頁")))
+    href = link.get_attribute('href')
+    parts = urlsplit(href)
+    url = parts._replace(query='', fragment='').geturl()
+
+    return url, dict(parse_qsl(parts.query, keep_blank_values=True))
+
+
+def grid_session(driver: WebDriver) -> Session:
+    "Build a requests session that carries the browser's cookies and identity."
+    session = transport.session()
+
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie['name'], cookie['value'],
+            domain=cookie.get('domain'), path=cookie.get('path', '/'),
+        )
+
+    session.headers['User-Agent'] = driver.execute_script('return navigator.userAgent;')
+    session.headers['Referer'] = driver.execute_script('return document.location.href;')
+
+    return session
+
+
+def fetch_grid_page(session: Session, url: str, params: Dict[str, str], page: int, per_page: int) -> List[Result]:
+    """Fetch one page of the result grid over HTTP and parse its rows.
+
+    A response that is not a grid, a grid whose rows do not parse, or a grid
+    for another page than ``page`` (its first row is not number
+    ``(page - 1) * per_page + 1``) counts as a rejection.
+    """
+    params = {**params, 'curpage': str(page)}
+
+    try:
+        with session.get(url, params=params) as resp:
+            resp.raise_for_status()
+            doc = BeautifulSoup(resp.text, 'html.parser')
+            page_url = resp.url
+    except RequestException as e:
+        raise GridRequestRejected(f'page {page}: {e}') from e
+
+    table = doc.find('table', class_='GridTableContent')
+    if table is None:
+        raise GridRequestRejected(f'page {page}: no result grid in response')
+
+    rows = table.find_all('tr')[1:]
+    expected = (page - 1) * per_page + 1
+
+    try:
+        if not rows or row_number(rows[0]) != expected:
+            raise GridRequestRejected(f'page {page}: server did not serve the requested page')
+
+        return [Result.from_soup_row(row, page_url) for row in rows]
+    except (ValueError, IndexError, KeyError, TypeError, AttributeError) as e:
+        raise GridRequestRejected(f'page {page}: unexpected grid layout ({e!r})') from e
+
+
+def hybrid_loop_through_results(driver: WebDriver, workers: int = 4) -> Iterable[Result]:
+    """Read the first page in the browser and fetch the rest concurrently over HTTP.
+
+    If the server rejects the HTTP requests, the remaining pages are read
+    through the browser instead.
+    """
+    result_page = SearchResults(driver)
+    n_articles, n_pages = result_page.number_of_articles_and_pages()
+    n_pages = min(n_pages, MAX_PAGES)
+
+    print(f"{n_articles} found. A maximum of 500 will be retrieved.")
+    print(f"Scraping page 1/{n_pages}")
+    print()
+
+    first_page = list(result_page.get_structured_elements())
+    yield from first_page
+
+    if n_pages <= 1:
+        return
+
+    url, params = grid_request(driver)
+    page = 2
+
+    with grid_session(driver) as session, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each page runs in a copy of this context, so that its timeout is
+        # taken from the job's deadline (the same object, not a snapshot)
+        # when the request is made.
+        futures = [
+            executor.submit(copy_context().run, fetch_grid_page, session, url, params, p, len(first_page))
+            for p in range(2, n_pages + 1)
+        ]
+
+        try:
+            for future in futures:
+                results = future.result()
+                print(f"Scraping page {page}/{n_pages}")
+                print()
+                yield from results
+                page += 1
+            return
+        except GridRequestRejected as e:
+            print(f"HTTP request rejected ({e}), falling back to the browser")
+        finally:
+            for future in futures:
+                future.cancel()
+
+    # Fall back: click through to the first page that could not be fetched.
+    for _ in range(1, page):
+        if result_page.next_page_fast() is None:
+            return
+        result_page = SearchResults(driver)
+
+    for page in range(page, n_pages + 1):
+        print(f"Scraping page {page}/{n_pages}")
+        print()
+        yield from result_page.get_structured_elements()
+
+        if page >= n_pages or result_page.next_page_fast() is None:
+            break
+        result_page = SearchResults(driver)
+
+
+def save_articles(articles: Iterable[SearchResults], file_prefix: str) -> None:
+    write_articles(articles, Path(file_prefix).with_suffix('.json'))
 
 
 def query(keyword, driver) -> None:
@@ -261,20 +516,40 @@ def query(keyword, driver) -> None:
     page.max_content()
 
 
-def search(keyword):
-    with Firefox() as driver:
+def search(keyword, fast: bool = False):
+    """Search CNKI for ``keyword``.
+
+    With ``fast`` set, a headless browser that blocks images, stylesheets and
+    fonts is used, and page transitions are detected by the old result grid
+    going stale rather than by waiting for the full page load.
+    """
+    with (fast_firefox() if fast else Firefox()) as driver:
+        driver.set_page_load_timeout(deadline.timeout(300))
         driver.get('http://cnki.sris.com.tw/kns55')
         query(keyword, driver)
 
         print("正在搜尋中國期刊網……")
         print(f"關鍵字：「{keyword}」")
 
-        result = loop_through_results(driver)
+        result = loop_through_results(driver, fast=fast)
         # save_articles(result, 'cnki_search_result.json')
 
         yield from result
 
 
+def hybrid_search(keyword, workers: int = 4):
+    """Search CNKI using the browser for the query and plain HTTP for result pages."""
+    with fast_firefox() as driver:
+        driver.set_page_load_timeout(deadline.timeout(300))
+        driver.get('http://cnki.sris.com.tw/kns55')
+        query(keyword, driver)
+
+        print("正在搜尋中國期刊網……")
+        print(f"關鍵字：「{keyword}」")
+
+        yield from hybrid_loop_through_results(driver, workers=workers)
+
+
 if __name__ == '__main__':
     result = search('尹至')
     save_articles(result, 'cnki_search_result.json')
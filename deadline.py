@@ -0,0 +1,152 @@
+# deadline.py
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from threading import Lock
+from typing import Iterator, Optional
+import math
+import time
+
+
+class DeadlineExceeded(Exception):
+    """The time budget ran out before a call could be made."""
+
+
+class Deadline:
+    """A point in time by which a job must finish.
+
+    Scrapers do not take a deadline argument; they call ``timeout(cap)`` for
+    every WebDriver wait, and the shared transport does the same for every
+    HTTP request, which bounds the call by whatever is left of the deadline
+    of the job they run in.
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.reset(seconds)
+
+    def reset(self, seconds: Optional[float] = None) -> None:
+        "Expire ``seconds`` from now, or never if None."
+        self.expires = math.inf if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        "``cap``, or less if the deadline is closer."
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return min(cap, remaining)
+
+
+class Budget:
+    """Seconds to share between the jobs of one database.
+
+    A job reserves its share up front and refunds what it did not use, so
+    jobs running at the same time cannot spend the same seconds twice.
+    """
+
+    def __init__(self, seconds: float):
+        self.left = seconds
+        self._lock = Lock()
+
+    def reserve(self, seconds: Optional[float] = None) -> float:
+        "Take ``seconds``, or everything that is left if that is less or None."
+        with self._lock:
+            granted = self.left if seconds is None else min(seconds, self.left)
+            granted = max(granted, 0.0)
+            self.left -= granted
+            return granted
+
+    def refund(self, seconds: float) -> None:
+        "Give back unused seconds; a negative amount charges an overrun."
+        with self._lock:
+            self.left += seconds
+
+
+_current: ContextVar[Deadline] = ContextVar('deadline', default=Deadline())
+
+
+def current() -> Deadline:
+    return _current.get()
+
+
+def timeout(cap: float) -> float:
+    "Timeout for one blocking call: ``cap``, bounded by the current job's deadline."
+    return current().timeout(cap)
+
+
+@contextmanager
+def scope(deadline: Deadline) -> Iterator[Deadline]:
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+@dataclass
+class JobStatus:
+    keyword: str
+    database: str
+    results: int = 0
+    elapsed: float = 0.0  # seconds spent inside the scraper
+    partial: bool = False
+    error: Optional[Exception] = None  # why the job failed, if it did
+
+
+def bounded(results: Iterator, seconds: Optional[float], status: JobStatus) -> Iterator:
+    """Yield from a scraper until it finishes or has run for ``seconds``.
+
+    Only time spent inside the scraper counts: while the consumer holds on to
+    a result, the clock stops. The job has one deadline, set to whatever is
+    left of ``seconds`` whenever the scraper runs and lifted while it is
+    paused, so threads the scraper started in a copy of its context see the
+    same clock. When time runs out, the scraper is closed (releasing its
+    browser or session) and the job is marked partial; results already
+    yielded are kept. A scraper that ends normally after its deadline passed,
+    e.g. because it took a timeout for the last page, or that lets
+    DeadlineExceeded through, is partial as well.
+    """
+    deadline = Deadline()
+    try:
+        while True:
+            deadline.reset(None if seconds is None else seconds - status.elapsed)
+
+            if deadline.expired():
+                break
+
+            start = time.monotonic()
+            try:
+                with scope(deadline):
+                    item = next(results)
+            except StopIteration:
+                if not deadline.expired():
+                    return
+                break
+            except DeadlineExceeded:
+                break
+            except Exception:
+                if not deadline.expired():
+                    raise
+                break
+            finally:
+                status.elapsed += time.monotonic() - start
+
+            status.results += 1
+            deadline.reset(None)
+            yield item
+
+        status.partial = True
+        print(
+            f"{status.database}「{status.keyword}」: time budget exhausted, "
+            f"keeping {status.results} partial results"
+        )
+    finally:
+        close = getattr(results, 'close', None)
+        if close is not None:
+            close()
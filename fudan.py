@@ -3,14 +3,16 @@
 from dataclasses import dataclass
 from itertools import count
 from pathlib import Path
-from typing import Dict, Iterable, Tuple, List, Optional
+from typing import Callable, Dict, Iterable, Tuple, List, Optional
 from urllib.parse import urljoin
 
 from bs4 import BeautifulSoup
 from requests import Session
 from datetime import date, datetime
 
-import json
+import transport
+from writers import write_articles
+
 import re
 import uuid
 
@@ -65,6 +67,7 @@ class Article:
     download: Optional[str]
     url: str
     publication: str = "復旦大學出土文獻與古文字研究中心學者文庫"
+    caption: Optional[str] = None
 
     @classmethod
     def from_link(cls, link: Link, download: str) -> 'Article':
@@ -83,6 +86,7 @@ class Article:
             date=link.added,
             download=download,
             url=link.url,
+            caption=link.caption,
         )
 
     def __str__(self) -> str:
@@ -178,27 +182,20 @@ def get_all_links(session: Session, query: str) -> Iterable[Link]:
 
 
 def save_articles(articles: Iterable[Article], file_prefix: str) -> None:
-    file_path = Path(file_prefix).with_suffix('.json')
-
-    with file_path.open('w') as file:
-        file.write('[\n')
-        first = True
-
-        for article in articles:
-            if first:
-                first = False
-            else:
-                file.write(',\n')
-            json.dump(article.as_dict(), file, ensure_ascii=False, indent=4)
+    write_articles(articles, Path(file_prefix).with_suffix('.json'))
 
-        file.write('\n]\n')
 
+def search(keyword, keep: Optional[Callable[[Link], bool]] = None):
+    """Search the academic library for ``keyword``.
 
-def search(keyword):
+    ``keep`` filters the result listing before each article page is fetched.
+    """
     print("正在搜尋復旦大學出土文獻與古文字研究中心學者文庫……")
     print(f"關鍵字：「{keyword}」")
-    with Session() as session:
+    with transport.session() as session:
         links = get_all_links(session, query=keyword)
+        if keep is not None:
+            links = filter(keep, links)
         academic_library = '学者文库'
         articles = compile_search_results(
             session, links, category_filter=academic_library)
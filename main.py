@@ -1,70 +1,281 @@
 import cnki, fudan, wuhan, qinghua
-import json
-from typing import Iterable, Tuple, List
+from collections import OrderedDict, defaultdict
+from functools import partial
+from typing import Dict, Iterable, Iterator, Tuple, List, Optional
 from pathlib import Path
 
 import bibtexparser
 from bibtexparser.bwriter import BibTexWriter
 from bibtexparser.bibdatabase import BibDatabase
 
+from deadline import Budget, JobStatus, bounded
+from planner import Batch, plan
+from pipeline import Pipeline, Stage
+from writers import atomic_open, output_path, write_articles, write_parquet
+
 DB_DICT = {
     "cnki": cnki.search,
+    "cnki_fast": partial(cnki.search, fast=True),
+    "cnki_hybrid": cnki.hybrid_search,
     "fudan": fudan.search,
     "wuhan": wuhan.search,
     "qinghua": qinghua.search,
     }
 
-def save_articles(articles: Iterable, file_prefix: str, output_format: str) -> None:
-    file_path = Path(file_prefix).with_suffix(f'.{output_format}')
+# Searched when no database is named; the cnki_* entries are alternative
+# ways to search CNKI and would only duplicate its results.
+DEFAULT_DBS = ("cnki", "fudan", "wuhan", "qinghua")
 
-    if output_format == "json":
+def save_articles(articles: Iterable, file_prefix: str, output_format: str,
+                  compression: Optional[str] = None, **parquet_options) -> None:
+    """Save articles as "json" (indented array), "jsonl" (one record per line), "bib" or "parquet".
 
-        with file_path.open('w') as file:
-            file.write('[\n')
-            first = True
+    ``compression`` may be "gzip" or "zstd". The file is only put in place once
+    it has been written completely. ``parquet_options`` (``batch_size``,
+    ``partition_by``) are passed on to writers.write_parquet.
+    """
+    if output_format == "parquet":
 
-            for article in articles:
+        write_parquet(articles, Path(file_prefix).with_suffix('.parquet'),
+                      compression=compression or 'snappy', **parquet_options)
+        return
 
-                if first:
-                    first = False
-                else:
-                    file.write(',\n')
-                json.dump(article.as_dict(), file, ensure_ascii=False, indent=4)
+    file_path = output_path(file_prefix, output_format, compression)
+
+    if output_format in ("json", "jsonl"):
 
-            file.write('\n]\n')
+        write_articles(articles, file_path, output_format, compression)
 
     elif output_format == "bib":
 
-        db = BibDatabase()
+        writer = BibTexWriter()
+
+        # Entries are written one at a time rather than collected in a
+        # BibDatabase, so memory does not grow with the number of results.
+        with atomic_open(file_path, compression) as bibfile:
+            first = True
 
-        for article in articles:
-            if article.as_bib():
+            for article in articles:
                 bib_dict = article.as_bib()
+                if not bib_dict:
+                    continue
                 bib_dict = {k: v for k, v in bib_dict.items() if v is not None}  # Remove none values.
+
+                db = BibDatabase()
                 db.entries.append(bib_dict)
 
-        writer = BibTexWriter()
+                if first:
+                    first = False
+                else:
+                    bibfile.write(b'\n')
+                bibfile.write(writer.write(db).encode())
+
+
+def run_job(keyword: str, db: str, job_budget: Optional[float] = None,
+            budgets: Optional[Dict[str, Budget]] = None,
+            statuses: Optional[List[JobStatus]] = None,
+            search_options: Optional[dict] = None) -> Iterator:
+    """Search one database for one keyword within its time budget.
 
-        with file_path.open('w') as bibfile:
-            bibfile.write(writer.write(db))
+    The job may spend ``job_budget`` seconds in the scraper, less if the
+    database's budget has less left. That share is reserved from the
+    database's budget up front; afterwards the unused part is refunded, or
+    an overrun charged, so that the database's budget stays a bound. On
+    expiry the job stops and its status is marked partial.
+    ``search_options`` are passed on to the database's search function.
+    """
+    budget = (budgets or {}).get(db)
+    allowance = budget.reserve(job_budget) if budget else job_budget
+    status = JobStatus(keyword, db)
+    if statuses is not None:
+        statuses.append(status)
 
+    try:
+        yield from bounded(DB_DICT[db](keyword, **(search_options or {})), allowance, status)
+    except Exception as e:
+        status.error = e
+        raise
+    finally:
+        if budget:
+            budget.refund(allowance - status.elapsed)
 
-def db_search(keyword: str, *args: Tuple[str]):
+
+def db_search(keyword: str, *args: Tuple[str], **budget_options):
 
     if args:
         
         for db in args:
-            yield from DB_DICT[db](keyword)
+            yield from run_job(keyword, db, **budget_options)
 
     else:
 
-        for key in DB_DICT.keys():
-            yield from DB_DICT[key](keyword)
+        for key in DEFAULT_DBS:
+            yield from run_job(keyword, key, **budget_options)
+
+
+def run_batch(batch: Batch, db: str, **budget_options) -> Iterator[Tuple[str, object]]:
+    """(keyword, article) pairs for one batch from planner.plan.
 
+    A merged search filters the site's result listing down to the batch's
+    keywords before anything else is fetched.
+    """
+    if not batch.merged:
+        yield from batch.demux(run_job(batch.query, db, **budget_options))
+        return
+
+    def keep(link) -> bool:
+        return bool(batch.route(link))
+
+    yield from batch.demux(run_job(batch.query, db, search_options={'keep': keep}, **budget_options))
+
+
+def batched_search(keywords: List[str], *args: str, job_budget: Optional[float] = None,
+                   db_budgets: Optional[Dict[str, float]] = None,
+                   statuses: Optional[List[JobStatus]] = None,
+                   max_batch: int = 5) -> Iterator[Tuple[str, object]]:
+    """Search each database once per batch of keywords rather than once per keyword.
+
+    Keywords are merged where the site allows it (see planner.STRATEGIES), and
+    every result is routed back to each keyword of its batch that occurs in
+    its title, caption or author. Yields (keyword, article) pairs in the
+    same order as search: keyword by keyword, then database by database.
+    Results a batch finds for its later keywords are held until their turn.
+    Budgets apply as in search, per batch.
+    """
+    keywords = list(dict.fromkeys(keywords))
+    dbs = args or DEFAULT_DBS
+    budgets = {db: Budget(seconds) for db, seconds in (db_budgets or {}).items()}
+    batches = {
+        (db, kw): batch
+        for db in dbs
+        for batch in plan(keywords, db, max_batch=max_batch)
+        for kw in batch.keywords
+    }
+    pending = defaultdict(list)  # (db, keyword) -> articles waiting for the keyword's turn
 
-def search(keywords: List[str], *args: str):
     for kw in keywords:
-        yield from db_search(kw, *args)
+        for db in dbs:
+            batch = batches[db, kw]
+
+            if kw != batch.keywords[0]:
+                for article in pending.pop((db, kw), ()):
+                    yield kw, article
+                continue
+
+            for match, article in run_batch(batch, db, job_budget=job_budget, budgets=budgets, statuses=statuses):
+                if match == kw:
+                    yield kw, article
+                else:
+                    pending[db, match].append(article)
+
+
+def search(keywords: List[str], *args: str, job_budget: Optional[float] = None,
+           db_budgets: Optional[Dict[str, float]] = None,
+           statuses: Optional[List[JobStatus]] = None, batched: bool = False,
+           max_batch: int = 5):
+    """Search each database for each keyword.
+
+    ``job_budget`` bounds the seconds spent on one keyword in one database;
+    ``db_budgets`` bounds the seconds spent on a database over all keywords.
+    Jobs that run out of time are cut short and recorded as partial in
+    ``statuses``, if given. With ``batched``, keywords are merged into fewer
+    searches of at most ``max_batch`` keywords each; see batched_search.
+    """
+    if batched:
+        for _, article in batched_search(keywords, *args, job_budget=job_budget,
+                                         db_budgets=db_budgets, statuses=statuses,
+                                         max_batch=max_batch):
+            yield article
+        return
+
+    budgets = {db: Budget(seconds) for db, seconds in (db_budgets or {}).items()}
+
+    for kw in keywords:
+        yield from db_search(kw, *args, job_budget=job_budget, budgets=budgets, statuses=statuses)
+
+
+def fetch(db: str, keywords: List[str], **budget_options) -> Iterator:
+    """Run the searches of one database, one keyword after the other.
+
+    Scrapers fetch and parse in one go. Keeping a database's jobs on one
+    worker means that no site, CNKI's browser in particular, is searched
+    twice at once. A failed search does not stop the others; its error is
+    kept in its JobStatus.
+    """
+    for keyword in keywords:
+        try:
+            yield from run_job(keyword, db, **budget_options)
+        except Exception as e:
+            print(f"{db}「{keyword}」: search failed: {e!r}")
+
+
+def normalize(article) -> Iterator[Tuple[Tuple[str, str, str], object]]:
+    "Pair each article with the key used to spot duplicates across keywords."
+    d = article.as_dict()
+    title = d.get('title', d.get('caption')) or ''
+    yield (type(article).__module__, ' '.join(title.split()), d.get('url') or ''), article
+
+
+class Dedup:
+    """Drop articles whose key has been seen before.
+
+    Only the ``max_keys`` most recently seen keys are remembered, so memory
+    stays bounded; a duplicate arriving after that many other articles
+    passes through.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self.seen = OrderedDict()
+
+    def __call__(self, item) -> Iterator:
+        key, article = item
+        if key in self.seen:
+            self.seen.move_to_end(key)
+            return
+
+        self.seen[key] = None
+        if len(self.seen) > self.max_keys:
+            self.seen.popitem(last=False)
+        yield article
+
+
+def pipeline_search(keywords: List[str], *args: str, queue_size: int = 100,
+                    fetch_workers: Optional[int] = None, report: bool = True,
+                    job_budget: Optional[float] = None,
+                    db_budgets: Optional[Dict[str, float]] = None,
+                    statuses: Optional[List[JobStatus]] = None) -> Iterator:
+    """Like search, but through a bounded pipeline: fetch, normalize, dedup.
+
+    Each database is one fetch job, which searches its keywords in turn; up to
+    ``fetch_workers`` databases (all of them by default) are searched at
+    once. The caller, e.g. save_articles, is the sink; a slow sink pauses the
+    scrapers instead of letting results accumulate.
+
+    A failed search does not hold up the others, but once they are done the
+    first error is raised, as search would have raised it; ``statuses`` then
+    tells which jobs failed.
+    """
+    if statuses is None:
+        statuses = []
+    dbs = args or DEFAULT_DBS
+    budgets = {db: Budget(seconds) for db, seconds in (db_budgets or {}).items()}
+    fetch_job = partial(fetch, keywords=keywords, job_budget=job_budget, budgets=budgets, statuses=statuses)
+
+    pipeline = Pipeline([
+        Stage('fetch', fetch_job, workers=fetch_workers or len(dbs), queue_size=queue_size),
+        Stage('normalize', normalize, queue_size=queue_size),
+        Stage('dedup', Dedup(), queue_size=queue_size),
+    ], output_size=queue_size)
+
+    yield from pipeline.run(dbs)
+
+    if report:
+        pipeline.report()
+
+    failed = [s for s in statuses if s.error is not None]
+    if failed:
+        raise failed[0].error
 
 
 if __name__ == '__main__':
@@ -0,0 +1,213 @@
+# pipeline.py
+
+from dataclasses import dataclass, field
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+import time
+
+_END = object()  # End-of-stream marker, one per downstream worker.
+_POLL = 0.1  # seconds between checks for cancellation while blocked on a queue
+
+
+@dataclass
+class Stage:
+    """One step of a pipeline.
+
+    ``func`` maps one inbound item to zero or more outbound items. ``queue_size``
+    bounds the stage's inbound queue, so a slow stage blocks the ones before it
+    instead of letting work pile up in memory.
+    """
+    name: str
+    func: Callable[[Any], Iterable[Any]]
+    workers: int = 1
+    queue_size: int = 100
+
+
+@dataclass
+class QueueStats:
+    size: int
+    samples: int = 0
+    total: int = 0
+    peak: int = 0
+
+    def sample(self, queue: Queue) -> None:
+        n = queue.qsize()
+        self.samples += 1
+        self.total += n
+        self.peak = max(self.peak, n)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.samples if self.samples else 0.0
+
+
+@dataclass
+class StageStats:
+    queue: QueueStats
+    busy: float = 0.0  # seconds spent in func, excluding time blocked on the next queue
+    items: int = 0
+    errors: List[Tuple[Any, Exception]] = field(default_factory=list)
+
+
+class Pipeline:
+    """Run stages in worker threads connected by bounded queues.
+
+    Items from the source go through each stage in turn, and whatever the
+    last stage emits is yielded by ``run``. The consumer of ``run`` acts as the
+    sink: when it falls behind, every stage upstream stalls once its queue is
+    full. Queue occupancy is sampled every ``sample_interval`` seconds; a stage
+    whose inbound queue stays full is the bottleneck.
+
+    If the consumer stops early, the workers are cancelled: generators
+    returned by stage functions are closed, so that scrapers release their
+    browsers and sessions, and ``run`` returns once every thread has exited.
+    """
+
+    def __init__(self, stages: Sequence[Stage], output_size: int = 100, sample_interval: float = 0.1):
+        self.stages = list(stages)
+        self.sample_interval = sample_interval
+        self.queues = [Queue(maxsize=s.queue_size) for s in self.stages]
+        self.queues.append(Queue(maxsize=output_size))
+        self.stats: Dict[str, StageStats] = {
+            s.name: StageStats(QueueStats(s.queue_size)) for s in self.stages
+        }
+        self.output_stats = QueueStats(output_size)
+        self._remaining = [s.workers for s in self.stages]
+        self._lock = Lock()
+        self._done = Event()
+        self._cancel = Event()
+
+    def _put(self, queue: Queue, item: Any) -> bool:
+        "Put ``item`` unless the pipeline is cancelled first; tell which happened."
+        while not self._cancel.is_set():
+            try:
+                queue.put(item, timeout=_POLL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _get(self, queue: Queue) -> Any:
+        "The next item, or _END if the pipeline is cancelled first."
+        while not self._cancel.is_set():
+            try:
+                return queue.get(timeout=_POLL)
+            except Empty:
+                pass
+        return _END
+
+    def _feed(self, source: Iterable[Any]) -> None:
+        inbound = self.queues[0]
+        for item in source:
+            if not self._put(inbound, item):
+                return
+        for _ in range(self.stages[0].workers):
+            if not self._put(inbound, _END):
+                return
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        stats = self.stats[stage.name]
+        inbound, outbound = self.queues[index], self.queues[index + 1]
+
+        while True:
+            item = self._get(inbound)
+            if item is _END:
+                break
+
+            start = time.perf_counter()
+            blocked = 0.0
+            outputs = None
+            try:
+                outputs = stage.func(item) or ()
+                for out in outputs:
+                    put_start = time.perf_counter()
+                    delivered = self._put(outbound, out)
+                    blocked += time.perf_counter() - put_start
+                    if not delivered:
+                        break
+            except Exception as e:
+                print(f"Stage {stage.name} failed on {item!r}: {e!r}")
+                with self._lock:
+                    stats.errors.append((item, e))
+            finally:
+                close = getattr(outputs, 'close', None)
+                if close is not None:
+                    close()
+
+            with self._lock:
+                stats.busy += time.perf_counter() - start - blocked
+                stats.items += 1
+
+        with self._lock:
+            self._remaining[index] -= 1
+            last = self._remaining[index] == 0
+
+        if last:
+            n_next = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            for _ in range(n_next):
+                if not self._put(outbound, _END):
+                    break
+
+    def _monitor(self) -> None:
+        while not self._done.wait(self.sample_interval):
+            for stage, queue in zip(self.stages, self.queues):
+                self.stats[stage.name].queue.sample(queue)
+            self.output_stats.sample(self.queues[-1])
+
+    def run(self, source: Iterable[Any]) -> Iterator[Any]:
+        threads = [Thread(target=self._feed, args=(source,), name='pipeline-feed', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.extend(
+                Thread(target=self._work, args=(index,), name=f'pipeline-{stage.name}-{n}', daemon=True)
+                for n in range(stage.workers)
+            )
+        monitor = Thread(target=self._monitor, name='pipeline-monitor', daemon=True)
+
+        for thread in threads:
+            thread.start()
+        monitor.start()
+
+        try:
+            output = self.queues[-1]
+            while True:
+                item = output.get()
+                if item is _END:
+                    break
+                yield item
+        finally:
+            # A no-op after a complete run; otherwise unblocks every worker.
+            self._cancel.set()
+            self._done.set()
+
+            for thread in threads:
+                thread.join()
+            monitor.join()
+
+    def occupancy(self) -> Dict[str, float]:
+        "Current fill ratio of each stage's inbound queue, plus the sink's."
+        ratios = {
+            stage.name: queue.qsize() / stage.queue_size
+            for stage, queue in zip(self.stages, self.queues)
+        }
+        ratios['sink'] = self.queues[-1].qsize() / self.output_stats.size
+        return ratios
+
+    def bottleneck(self) -> str:
+        "The stage whose inbound queue was fullest on average."
+        ratios = {name: s.queue.mean / s.queue.size for name, s in self.stats.items()}
+        ratios['sink'] = self.output_stats.mean / self.output_stats.size
+        return max(ratios, key=ratios.get)
+
+    def report(self) -> None:
+        print(f"{'stage':<12}{'workers':>8}{'items':>8}{'busy s':>9}{'queue avg':>11}{'peak':>10}")
+        for stage in self.stages:
+            s = self.stats[stage.name]
+            print(
+                f"{stage.name:<12}{stage.workers:>8}{s.items:>8}{s.busy:>9.2f}"
+                f"{s.queue.mean:>11.1f}{f'{s.queue.peak}/{s.queue.size}':>10}"
+            )
+        out = self.output_stats
+        print(f"{'sink':<12}{'':>8}{'':>8}{'':>9}{out.mean:>11.1f}{f'{out.peak}/{out.size}':>10}")
+        print(f"Bottleneck: {self.bottleneck()}")
@@ -0,0 +1,79 @@
+# planner.py
+
+from dataclasses import dataclass
+from os.path import commonprefix
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# How each site can answer several keywords with one search. Merging is only
+# safe where routing results back (see Batch.route) sees what the site's own
+# search matched on:
+#   'prefix' - substring search on the listed captions, so a shared prefix
+#              finds every keyword's results, and the listing can be routed
+#              before any per-result request (fudan.search's ``keep``).
+# CNKI (subject search over abstracts and keywords) and Wuhan (full-text
+# search) match on text we never see, so they are searched per keyword.
+STRATEGIES = {
+    'fudan': 'prefix',
+}
+
+# Fields checked when routing a result back to the keywords of a batch.
+MATCH_FIELDS = ('title', 'caption', 'author')
+
+
+@dataclass(frozen=True)
+class Batch:
+    database: str
+    query: str
+    keywords: Tuple[str, ...]
+
+    @property
+    def merged(self) -> bool:
+        return self.keywords != (self.query,)
+
+    def route(self, article) -> List[str]:
+        """The keywords of this batch that ``article`` belongs to.
+
+        A keyword that is the query itself takes every result, as an unbatched
+        search for it would.
+        """
+        text = '\n'.join(
+            value for value in (getattr(article, field, None) for field in MATCH_FIELDS)
+            if isinstance(value, str)
+        )
+        return [kw for kw in self.keywords if kw == self.query or kw in text]
+
+    def demux(self, articles: Iterable) -> Iterator[Tuple[str, object]]:
+        "(keyword, article) for each keyword each article matches."
+        for article in articles:
+            for keyword in self.route(article):
+                yield keyword, article
+
+
+def prefix_batches(database: str, keywords: Sequence[str], max_batch: int, min_prefix: int) -> Iterator[Batch]:
+    """Group keywords sharing a prefix of at least ``min_prefix`` characters.
+
+    A shorter prefix would match far more than the keywords themselves.
+    Groups keep the order in which their keywords first appear.
+    """
+    groups: Dict[str, List[str]] = {}
+    for kw in keywords:
+        groups.setdefault(kw[:min_prefix], []).append(kw)
+
+    for group in groups.values():
+        for i in range(0, len(group), max_batch):
+            chunk = tuple(group[i:i + max_batch])
+            yield Batch(database, commonprefix(chunk), chunk)
+
+
+def plan(keywords: Sequence[str], database: str, max_batch: int = 5, min_prefix: int = 2) -> List[Batch]:
+    """Split ``keywords`` into as few searches of ``database`` as it allows.
+
+    ``max_batch`` caps the keywords per search.
+    """
+    keywords = list(dict.fromkeys(keywords))  # drop repeats, keep order
+    strategy = STRATEGIES.get(database)
+
+    if strategy == 'prefix':
+        return list(prefix_batches(database, keywords, max_batch, min_prefix))
+
+    return [Batch(database, kw, (kw,)) for kw in keywords]
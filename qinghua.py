@@ -4,13 +4,14 @@ from typing import Iterable, ClassVar, List, Dict
 
 from attr import dataclass
 from bs4 import BeautifulSoup, SoupStrainer, Tag
-from requests import Session
 import re
 from itertools import count
 from urllib.parse import urljoin
 
 import uuid
 
+import transport
+
 BASE_URL = 'https://www.ctwx.tsinghua.edu.cn'
 
 @dataclass
@@ -59,7 +60,7 @@ class TsinghuaSite:
     pagination: ClassVar[SoupStrainer] = SoupStrainer(name='table', class_='listFrame')
 
     def __init__(self):
-        self.session = Session()
+        self.session = transport.session()
 
     def __enter__(self) -> 'TsinghuaSite':
         return self
@@ -86,7 +87,6 @@ class TsinghuaSite:
             n_pages = int(re.search(r'\d+', n_pages_string)[0])
 
             if n_pages > 1:
-                docs = []
 
                 for page in count(1):
                     with self.session.get(
@@ -102,10 +102,10 @@ class TsinghuaSite:
                         resp.raise_for_status()
                         doc = BeautifulSoup(markup=resp.text, features='html.parser', parse_only=self.subdoc)
                         print(f"Scraping page {page}/{n_pages}.")
-                        docs.append(doc)
+
+                    yield doc
 
                     if page >= n_pages:
-                        yield from docs
                         break
 
                 else:
@@ -123,9 +123,7 @@ class TsinghuaSite:
 def search(keyword):
     with TsinghuaSite() as site:
         query = keyword
-        results = tuple(site.yield_results(query))
-
-    yield from results
+        yield from site.yield_results(query)
 
 def main():
 
@@ -0,0 +1,249 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import pytest
+
+import deadline
+from deadline import Budget, DeadlineExceeded, JobStatus, bounded
+from pipeline import Pipeline, Stage
+from planner import Batch, plan
+
+
+class Link:
+    def __init__(self, caption):
+        self.caption = caption
+
+
+def pipeline_threads():
+    return [t for t in threading.enumerate() if t.name.startswith('pipeline-')]
+
+
+def test_pipeline_passes_every_item_through():
+    pipeline = Pipeline([
+        Stage('fetch', lambda n: range(n), workers=3, queue_size=2),
+        Stage('double', lambda x: [x * 2], workers=2, queue_size=2),
+    ], output_size=2)
+
+    assert sorted(pipeline.run([3, 4])) == [0, 0, 2, 2, 4, 4, 6]
+    assert pipeline.stats['double'].items == 7
+    assert not pipeline_threads()
+
+
+def test_pipeline_early_exit_closes_generators_and_joins_threads():
+    closed = []
+
+    def fetch(job):
+        try:
+            for i in range(1000):
+                yield job, i
+        finally:
+            closed.append(job)
+
+    pipeline = Pipeline([
+        Stage('fetch', fetch, workers=2, queue_size=1),
+        Stage('normalize', lambda item: [item], queue_size=1),
+    ], output_size=1)
+
+    results = pipeline.run(['a', 'b'])
+    next(results)
+    results.close()
+
+    assert not pipeline_threads()
+    assert sorted(closed) == ['a', 'b']
+
+
+def test_pipeline_keeps_going_after_a_stage_error():
+    pipeline = Pipeline([Stage('invert', lambda x: [1 / x])], output_size=4)
+
+    assert sorted(pipeline.run([1, 0, 2])) == [0.5, 1.0]
+    assert [item for item, _ in pipeline.stats['invert'].errors] == [0]
+
+
+def slow_scraper(pages, delay):
+    """Yield a page every ``delay`` seconds; like cnki.next_page_fast, a wait
+    that times out is taken for the last page."""
+    for page in range(pages):
+        timeout = deadline.timeout(delay)
+        time.sleep(timeout)
+        if timeout < delay:
+            return
+        yield page
+
+
+def test_bounded_marks_swallowed_timeout_partial():
+    status = JobStatus('尹至', 'cnki')
+
+    results = list(bounded(slow_scraper(100, 0.02), 0.07, status))
+
+    assert results == list(range(len(results))) and len(results) < 100
+    assert status.partial
+
+
+def test_bounded_closes_scraper_when_time_runs_out():
+    closed = []
+    status = JobStatus('尹至', 'cnki')
+
+    def scraper():
+        try:
+            while True:
+                time.sleep(deadline.timeout(0.02))
+                yield 'article'
+        finally:
+            closed.append(True)
+
+    results = list(bounded(scraper(), 0.05, status))
+
+    assert 1 <= len(results) <= 3
+    assert status.partial
+    assert closed == [True]
+
+
+def test_bounded_complete_job_is_not_partial():
+    status = JobStatus('尹至', 'wuhan')
+
+    assert list(bounded(iter([1, 2]), 1, status)) == [1, 2]
+    assert not status.partial
+
+
+def test_bounded_does_not_count_time_held_by_consumer():
+    status = JobStatus('尹至', 'wuhan')
+    results = []
+
+    for page in bounded(slow_scraper(3, 0.01), 0.1, status):
+        results.append(page)
+        time.sleep(0.06)  # a slow sink
+
+    assert results == [0, 1, 2]
+    assert not status.partial
+    assert status.elapsed < 0.1
+
+
+def test_budget_reservations_do_not_overlap():
+    budget = Budget(10)
+
+    assert budget.reserve(6) == 6
+    assert budget.reserve(6) == 4
+    assert budget.reserve(6) == 0
+
+    budget.refund(3)
+    assert budget.reserve() == 3
+
+
+def test_budget_charges_overruns():
+    budget = Budget(1)
+
+    allowance = budget.reserve(1)
+    budget.refund(allowance - 1.5)
+
+    assert budget.left == -0.5
+    assert budget.reserve(1) == 0
+
+
+def test_bounded_marks_deadline_exceeded_partial():
+    status = JobStatus('尹至', 'cnki')
+
+    def scraper():
+        yield 'article'
+        raise DeadlineExceeded()
+
+    assert list(bounded(scraper(), 1, status)) == ['article']
+    assert status.partial
+
+
+def test_bounded_clock_is_shared_with_worker_threads():
+    """Like cnki.hybrid_loop_through_results: pages fetched in the background
+    read the job's deadline while the consumer holds a result."""
+    status = JobStatus('尹至', 'cnki')
+
+    def fetch(page):
+        time.sleep(0.1)
+        deadline.timeout(1)
+        return page
+
+    def scraper():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(copy_context().run, fetch, p) for p in (2, 3)]
+            yield 1
+            for future in futures:
+                yield future.result()
+
+    results = []
+    for page in bounded(scraper(), 0.08, status):
+        results.append(page)
+        time.sleep(0.15)  # a slow sink
+
+    assert results == [1, 2, 3]
+    assert not status.partial
+
+
+def test_plan_keeps_keyword_order():
+    batches = plan(['郭店楚簡', '清華尹至', '尹誥', '郭店老子', '清華尹誥', '郭店楚簡'], 'fudan')
+
+    assert [b.keywords for b in batches] == [
+        ('郭店楚簡', '郭店老子'), ('清華尹至', '清華尹誥'), ('尹誥',),
+    ]
+    assert [b.query for b in batches] == ['郭店', '清華尹', '尹誥']
+
+
+def test_plan_splits_batches_at_max_batch():
+    batches = plan(['郭店1', '郭店2', '郭店3'], 'fudan', max_batch=2)
+
+    assert [b.keywords for b in batches] == [('郭店1', '郭店2'), ('郭店3',)]
+    assert not batches[1].merged
+
+
+def test_plan_searches_unrouteable_sites_per_keyword():
+    for db in ('cnki', 'wuhan'):
+        batches = plan(['郭店楚簡', '郭店老子'], db)
+        assert [b.keywords for b in batches] == [('郭店楚簡',), ('郭店老子',)]
+        assert not any(b.merged for b in batches)
+
+
+def test_batch_routes_results_to_matching_keywords():
+    batch = Batch('fudan', '郭店', ('郭店楚簡', '郭店老子'))
+    articles = [
+        Link(caption='李零：郭店楚簡校讀記'),
+        Link(caption='郭店老子與郭店楚簡'),
+        Link(caption='郭店一號墓'),
+    ]
+
+    assert list(batch.demux(articles)) == [
+        ('郭店楚簡', articles[0]),
+        ('郭店楚簡', articles[1]),
+        ('郭店老子', articles[1]),
+    ]
+
+
+def test_unmerged_batch_takes_every_result():
+    batch = Batch('cnki', '尹至', ('尹至',))
+
+    assert batch.route(Link(caption='清華簡研究')) == ['尹至']
+
+
+def test_pipeline_search_reports_failed_keywords(monkeypatch):
+    main = pytest.importorskip('main')
+
+    class Article:
+        def __init__(self, title):
+            self.title = title
+
+        def as_dict(self):
+            return {'title': self.title}
+
+    def scraper(keyword):
+        if keyword == 'k1':
+            raise RuntimeError('site down')
+        yield Article(keyword)
+
+    monkeypatch.setitem(main.DB_DICT, 'wuhan', scraper)
+    statuses = []
+    results = []
+
+    with pytest.raises(RuntimeError, match='site down'):
+        for article in main.pipeline_search(['k1', 'k2', 'k3'], 'wuhan', report=False, statuses=statuses):
+            results.append(article.title)
+
+    assert results == ['k2', 'k3']
+    assert [(s.keyword, s.error is not None) for s in statuses] == [('k1', True), ('k2', False), ('k3', False)]
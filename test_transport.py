@@ -0,0 +1,84 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+requests = pytest.importorskip('requests')
+
+import deadline
+import transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections alive
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.5)
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            pass  # the client timed out and hung up
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_transport():
+    yield
+    transport.configure()
+
+
+def test_request_timeout_combines_configuration_and_deadline():
+    assert transport.request_timeout((5, 60), None) == (5, 60)
+    assert transport.request_timeout((5, 60), 30) == (5, 30)
+    assert transport.request_timeout((5, 60), (None, 10)) == (5, 10)
+
+    with deadline.scope(deadline.Deadline(2)):
+        connect, read = transport.request_timeout((5, 60), None)
+    assert connect <= 2 and read <= 2
+
+
+@pytest.mark.parametrize('http2', [False, True])
+def test_configured_read_timeout_applies(server, http2):
+    if http2:
+        pytest.importorskip('httpx')
+    transport.configure(read_timeout=0.1, http2=http2)
+
+    with transport.session() as session:
+        assert session.get(f'{server}/fast').text == 'ok'
+        assert session.get(f'{server}/fast', verify=False).text == 'ok'
+        with pytest.raises(requests.Timeout):
+            session.get(f'{server}/slow')
+
+
+@pytest.mark.parametrize('http2', [False, True])
+def test_sessions_reuse_shared_connections(server, http2):
+    if http2:
+        pytest.importorskip('httpx')
+    transport.configure(http2=http2)
+
+    for _ in range(3):
+        with transport.session() as session:
+            for _ in range(2):
+                assert session.get(f'{server}/fast').text == 'ok'
+
+    host = server.split('//', 1)[1]
+    stats = transport.stats()[host]
+    assert (stats.requests, stats.connections, stats.reused) == (6, 1, 5)
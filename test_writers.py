@@ -0,0 +1,148 @@
+import gzip
+import json
+import os
+from datetime import date
+
+import pytest
+
+from writers import ParquetArticleWriter, atomic_open, output_path, write_articles, write_parquet
+
+
+class Article:
+    def __init__(self, title, published=date(2020, 12, 28), download=None, database='期刊'):
+        self.title = title
+        self.date = published
+        self.download = download
+        self.database = database
+
+    def as_dict(self):
+        return {
+            'title': self.title,
+            'date': self.date.isoformat(),
+            'url': f'http://example.com/{self.title}',
+            'download': self.download,
+        }
+
+
+ARTICLES = [Article('尹至'), Article('尹誥', download='http://example.com/dl')]
+
+
+def failing(articles):
+    yield from articles
+    raise RuntimeError('scraper failed')
+
+
+def test_atomic_open_replaces_only_on_success(tmp_path):
+    path = tmp_path / 'out.bin'
+    path.write_bytes(b'old')
+
+    with pytest.raises(RuntimeError):
+        with atomic_open(path) as file:
+            file.write(b'new')
+            raise RuntimeError()
+    assert path.read_bytes() == b'old'
+
+    with atomic_open(path) as file:
+        file.write(b'new')
+    assert path.read_bytes() == b'new'
+    assert os.listdir(tmp_path) == ['out.bin']
+
+
+def test_write_articles_keeps_old_file_when_producer_fails(tmp_path):
+    path = tmp_path / 'search_result.json'
+    write_articles(ARTICLES, path)
+
+    with pytest.raises(RuntimeError, match='scraper failed'):
+        write_articles(failing(ARTICLES * 1000), path, 'jsonl')
+
+    assert [r['title'] for r in json.loads(path.read_text())] == ['尹至', '尹誥']
+    assert os.listdir(tmp_path) == ['search_result.json']
+
+
+@pytest.mark.parametrize('output_format, compression', [
+    ('json', None), ('jsonl', None), ('json', 'gzip'), ('jsonl', 'gzip'),
+])
+def test_write_articles_round_trip(tmp_path, output_format, compression):
+    path = output_path(str(tmp_path / 'search_result'), output_format, compression)
+    write_articles(ARTICLES, path, output_format, compression)
+
+    opener = gzip.open if compression == 'gzip' else open
+    with opener(path, 'rt', encoding='utf-8') as file:
+        if output_format == 'json':
+            records = json.load(file)
+        else:
+            records = [json.loads(line) for line in file]
+
+    assert records == [a.as_dict() for a in ARTICLES]
+
+
+def test_parquet_schema(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'out.parquet'
+
+    write_parquet(ARTICLES, path, batch_size=1)
+
+    table = pq.read_table(path)
+    assert table.schema.field('date').type == pa.date32()
+    for column in ('database', 'source_type', 'publication'):
+        assert pa.types.is_dictionary(table.schema.field(column).type)
+    assert table.schema.field('download').nullable
+    assert table.column('download').to_pylist() == [None, 'http://example.com/dl']
+    assert table.column('database').to_pylist() == [__name__] * 2
+    assert pq.ParquetFile(path).num_row_groups == 2
+
+
+def test_parquet_partition_layout(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'out.parquet'
+    articles = [Article('尹至'), Article('郭店', published=date(2019, 1, 1))]
+
+    write_parquet(articles, path, partition_by=['database', 'year'])
+
+    files = sorted(p.relative_to(path).as_posix() for p in path.rglob('*.parquet'))
+    assert files == [
+        f'database={__name__}/year=2019/part-0.parquet',
+        f'database={__name__}/year=2020/part-0.parquet',
+    ]
+    assert 'year' not in pq.read_schema(path / files[0]).names
+
+
+def test_parquet_empty_output(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    for partition_by in ((), ('year',)):
+        path = tmp_path / f'empty{len(partition_by)}.parquet'
+        write_parquet([], path, partition_by=partition_by)
+        assert pq.read_table(path).num_rows == 0
+
+
+def test_parquet_replaces_files_and_directories(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'out.parquet'
+
+    write_parquet(ARTICLES, path, partition_by=['year'])
+    write_parquet(ARTICLES[:1], path)
+    assert path.is_file() and pq.read_table(path).num_rows == 1
+
+    write_parquet(ARTICLES, path, partition_by=['year'])
+    assert path.is_dir()
+    assert os.listdir(tmp_path) == ['out.parquet']
+
+
+def test_parquet_failures_leave_no_staging(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'out.parquet'
+    write_parquet(ARTICLES, path)
+
+    with pytest.raises(RuntimeError):
+        write_parquet(failing(ARTICLES), path, partition_by=['year'])
+
+    writer = ParquetArticleWriter(path, partition_by=['year'])
+    writer.write(ARTICLES[0])
+    writer._replace = lambda: os.replace('/nonexistent', path)
+    with pytest.raises(OSError):
+        writer.close()
+
+    assert os.listdir(tmp_path) == ['out.parquet']
+    assert pq.read_table(path).num_rows == 2
@@ -0,0 +1,284 @@
+# transport.py
+
+from collections import defaultdict
+from dataclasses import dataclass
+from http.client import HTTPMessage
+from threading import Lock
+import os
+import ssl
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from requests import ConnectionError, Response, Session, Timeout
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import DEFAULT_CA_BUNDLE_PATH, get_encoding_from_headers, select_proxy
+
+import deadline
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+TimeoutType = Union[None, float, Tuple[float, float]]
+
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    connections: int = 0  # new TCP connections, i.e. handshakes paid
+
+    @property
+    def reused(self) -> int:
+        return self.requests - self.connections
+
+
+class _Counters:
+    def __init__(self):
+        self.hosts: Dict[str, HostStats] = defaultdict(HostStats)
+        self.lock = Lock()
+
+    def add(self, host: str, requests: int = 0, connections: int = 0) -> None:
+        with self.lock:
+            stats = self.hosts[host]
+            stats.requests += requests
+            stats.connections += connections
+
+
+def request_timeout(default: Tuple[float, float], timeout: TimeoutType) -> Tuple[float, float]:
+    """The configured ``(connect, read)`` timeouts for one request.
+
+    A timeout passed with the request lowers them, and both are bounded by
+    what is left of the current job's deadline (see deadline.timeout).
+    """
+    connect, read = default
+    if timeout is not None:
+        cap_connect, cap_read = _split_timeout(timeout)
+        connect = min(connect, cap_connect) if cap_connect is not None else connect
+        read = min(read, cap_read) if cap_read is not None else read
+    return deadline.timeout(connect), deadline.timeout(read)
+
+
+class PooledAdapter(HTTPAdapter):
+    """An HTTPAdapter shared by every scraper session.
+
+    Closing a session does not close the shared pools; ``shutdown`` does.
+    Requests get ``(connect_timeout, read_timeout)``; see request_timeout.
+    """
+
+    def __init__(self, pool_size: int, connect_timeout: float, read_timeout: float):
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.default_timeout = (connect_timeout, read_timeout)
+        self.pools: Dict[str, object] = {}  # host -> urllib3 connection pool
+        self.lock = Lock()
+
+    def send(self, request, stream=False, timeout: TimeoutType = None, **kwargs) -> Response:
+        return super().send(request, stream=stream, timeout=request_timeout(self.default_timeout, timeout), **kwargs)
+
+    def get_connection_with_tls_context(self, request, *args, **kwargs):
+        pool = super().get_connection_with_tls_context(request, *args, **kwargs)
+        self._register(request.url, pool)
+        return pool
+
+    def get_connection(self, url, proxies=None):
+        # Used instead of the above by requests < 2.32.
+        pool = super().get_connection(url, proxies)
+        self._register(url, pool)
+        return pool
+
+    def _register(self, url: str, pool) -> None:
+        with self.lock:
+            self.pools[urlsplit(url).netloc] = pool
+
+    def stats(self) -> Dict[str, HostStats]:
+        # urllib3 pools count the requests they served and the connections they opened.
+        with self.lock:
+            return {
+                host: HostStats(requests=pool.num_requests, connections=pool.num_connections)
+                for host, pool in self.pools.items()
+            }
+
+    def close(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        super().close()
+
+
+class _Raw:
+    "Enough of a urllib3 response for requests to read cookies off an httpx response."
+
+    def __init__(self, headers):
+        msg = HTTPMessage()
+        for name, value in headers.multi_items():
+            msg[name] = value
+        self._original_response = SimpleNamespace(msg=msg)
+
+    def release_conn(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _ssl_context(verify: Union[bool, str], cert: Union[None, str, Tuple[str, str]]) -> ssl.SSLContext:
+    "An SSL context doing what requests does for ``verify`` and ``cert``."
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        ca = DEFAULT_CA_BUNDLE_PATH if verify is True else verify
+        if os.path.isdir(ca):
+            context = ssl.create_default_context(capath=ca)
+        else:
+            context = ssl.create_default_context(cafile=ca)
+
+    if cert:
+        context.load_cert_chain(*((cert,) if isinstance(cert, str) else cert))
+    return context
+
+
+class Http2Adapter(BaseAdapter):
+    """Send requests through shared httpx clients speaking HTTP/2.
+
+    Sessions keep the requests API (cookies, exceptions, ``raise_for_status``);
+    only the wire protocol changes. Needs ``httpx[http2]``.
+
+    httpx sets TLS verification, client certificates and proxies per client,
+    not per request, so there is one client for each combination of
+    ``verify``, ``cert`` and proxy that requests are sent with.
+    """
+
+    def __init__(self, pool_size: int, connect_timeout: float, read_timeout: float):
+        if httpx is None:
+            raise RuntimeError('HTTP/2 requires the httpx package with the http2 extra')
+        super().__init__()
+        self.pool_size = pool_size
+        self.default_timeout = (connect_timeout, read_timeout)
+        self.counters = _Counters()
+        self.clients: Dict[tuple, 'httpx.Client'] = {}
+        self.lock = Lock()
+
+    def client(self, verify, cert, proxy: Optional[str]) -> 'httpx.Client':
+        key = (verify, cert, proxy)
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = httpx.Client(
+                    http2=True,
+                    verify=_ssl_context(verify, cert),
+                    proxy=proxy,
+                    trust_env=False,  # requests has already applied the environment
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                )
+            return self.clients[key]
+
+    def send(self, request, stream=False, timeout: TimeoutType = None, verify=True, cert=None, proxies=None) -> Response:
+        client = self.client(verify, cert, select_proxy(request.url, proxies or {}))
+        connect, read = request_timeout(self.default_timeout, timeout)
+        host = urlsplit(request.url).netloc
+        self.counters.add(host, requests=1)
+
+        def trace(event: str, info: dict) -> None:
+            if event == 'connection.connect_tcp.started':
+                self.counters.add(host, connections=1)
+
+        try:
+            r = client.request(
+                request.method, request.url,
+                headers=dict(request.headers),
+                content=request.body,
+                timeout=httpx.Timeout(read, connect=connect),
+                extensions={'trace': trace},
+            )
+        except httpx.TimeoutException as e:
+            raise Timeout(e, request=request)
+        except httpx.TransportError as e:
+            raise ConnectionError(e, request=request)
+
+        response = Response()
+        response.status_code = r.status_code
+        response.reason = r.reason_phrase
+        response.headers = CaseInsensitiveDict(r.headers.multi_items())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = str(r.url)
+        response.request = request
+        response.raw = _Raw(r.headers)
+        response._content = r.content
+        response.connection = self
+        return response
+
+    def stats(self) -> Dict[str, HostStats]:
+        with self.counters.lock:
+            return {host: HostStats(s.requests, s.connections) for host, s in self.counters.hosts.items()}
+
+    def close(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
+
+
+def _split_timeout(timeout: Union[float, Tuple[Optional[float], Optional[float]]]) -> Tuple[Optional[float], Optional[float]]:
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
+
+
+_adapter: Optional[Union[PooledAdapter, Http2Adapter]] = None
+_config = dict(pool_size=10, connect_timeout=5, read_timeout=30, http2=False)
+_lock = Lock()
+
+
+def configure(pool_size: int = 10, connect_timeout: float = 5, read_timeout: float = 30, http2: bool = False) -> None:
+    """Set up the process-wide transport; takes effect for sessions created afterwards.
+
+    ``pool_size`` is the number of hosts kept in the pool and the number of
+    keep-alive connections per host.
+    """
+    global _adapter
+    with _lock:
+        _config.update(pool_size=pool_size, connect_timeout=connect_timeout,
+                       read_timeout=read_timeout, http2=http2)
+        if _adapter is not None:
+            _adapter.shutdown()
+            _adapter = None
+
+
+def adapter() -> Union[PooledAdapter, Http2Adapter]:
+    global _adapter
+    with _lock:
+        if _adapter is None:
+            config = dict(_config)
+            http2 = config.pop('http2')
+            _adapter = (Http2Adapter if http2 else PooledAdapter)(**config)
+        return _adapter
+
+
+def session() -> Session:
+    """A session with its own cookies and headers, on the shared connection pools.
+
+    Sessions are cheap: make one per search or per thread, and close it when
+    done; the connections stay open for the next one.
+    """
+    s = Session()
+    shared = adapter()
+    s.mount('http://', shared)
+    s.mount('https://', shared)
+    return s
+
+
+def stats() -> Dict[str, HostStats]:
+    "Requests sent and connections opened per host since the transport was set up."
+    return adapter().stats()
+
+
+def report() -> None:
+    print(f"{'host':<32}{'requests':>10}{'connects':>10}{'reused':>8}")
+    for host, s in sorted(stats().items()):
+        print(f"{host:<32}{s.requests:>10}{s.connections:>10}{s.reused:>8}")
@@ -0,0 +1,403 @@
+# writers.py
+
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+Encoder = Callable[[Dict], bytes]
+
+COMPRESSION_SUFFIXES = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+_DONE = object()  # Queue sentinel telling the writer thread to finish.
+
+
+def pretty_encoder(record: Dict) -> bytes:
+    "Indented JSON, as written by the original save_articles."
+    return json.dumps(record, ensure_ascii=False, indent=4).encode()
+
+
+def compact_encoder(record: Dict) -> bytes:
+    "Single-line JSON, using orjson when it is installed."
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def output_path(file_prefix: str, output_format: str, compression: Optional[str] = None) -> Path:
+    "search_result, jsonl, gzip -> search_result.jsonl.gz"
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f'Unknown compression: {compression}')
+
+    path = Path(file_prefix).with_suffix(f'.{output_format}')
+    return path.with_name(path.name + COMPRESSION_SUFFIXES[compression])
+
+
+@contextmanager
+def atomic_open(file_path: Path, compression: Optional[str] = None) -> Iterator[BinaryIO]:
+    """Open a binary file which only replaces ``file_path`` once it is complete.
+
+    Data goes to a temporary file in the same directory, which is renamed over
+    ``file_path`` on success and removed if an exception is raised.
+    """
+    fd, tmp_name = tempfile.mkstemp(
+        dir=file_path.parent, prefix=f'.{file_path.name}.', suffix='.tmp',
+    )
+    os.chmod(tmp_name, 0o644)  # mkstemp creates the file as 0600.
+
+    try:
+        with open(fd, 'wb') as raw:
+            if compression is None:
+                yield raw
+            elif compression == 'gzip':
+                with gzip.GzipFile(fileobj=raw, mode='wb') as file:
+                    yield file
+            elif compression == 'zstd':
+                if zstandard is None:
+                    raise RuntimeError('zstd compression requires the zstandard package')
+                with zstandard.ZstdCompressor().stream_writer(raw, closefd=False) as file:
+                    yield file
+            else:
+                raise ValueError(f'Unknown compression: {compression}')
+
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+class ArticleWriter:
+    """Write article records from a background thread.
+
+    Records are handed over through a bounded queue, so that encoding and disk
+    I/O overlap with scraping while memory use stays capped at ``queue_size``
+    records. ``output_format`` is either 'json' (an indented JSON array) or
+    'jsonl' (one compact record per line).
+    """
+
+    def __init__(
+        self,
+        file_path: Path,
+        output_format: str = 'json',
+        compression: Optional[str] = None,
+        encoder: Optional[Encoder] = None,
+        queue_size: int = 1000,
+    ):
+        if output_format not in ('json', 'jsonl'):
+            raise ValueError(f'Unknown output format: {output_format}')
+
+        self.file_path = Path(file_path)
+        self.output_format = output_format
+        self.compression = compression
+        self.encoder = encoder or (pretty_encoder if output_format == 'json' else compact_encoder)
+        self.queue: Queue = Queue(maxsize=queue_size)
+        self.thread = Thread(target=self._run, name=f'writer-{self.file_path.name}', daemon=True)
+        self.error: Optional[BaseException] = None
+        self.aborted = False
+        self.drained = False
+
+    def __enter__(self) -> 'ArticleWriter':
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.aborted = True
+        self.close()
+
+    def _run(self) -> None:
+        try:
+            with atomic_open(self.file_path, self.compression) as file:
+                if self.output_format == 'json':
+                    self._write_array(file)
+                else:
+                    self._write_lines(file)
+
+                if self.aborted:
+                    raise RuntimeError('writer aborted')
+        except BaseException as e:
+            self.error = e
+            # Keep draining so that the producer never blocks on a dead writer.
+            while not self.drained and self.queue.get() is not _DONE:
+                pass
+
+    def _records(self) -> Iterator[Dict]:
+        while True:
+            record = self.queue.get()
+            if record is _DONE:
+                self.drained = True
+                return
+            yield record
+
+    def _write_array(self, file: BinaryIO) -> None:
+        file.write(b'[\n')
+        first = True
+
+        for record in self._records():
+            if first:
+                first = False
+            else:
+                file.write(b',\n')
+            file.write(self.encoder(record))
+
+        file.write(b'\n]\n')
+
+    def _write_lines(self, file: BinaryIO) -> None:
+        for record in self._records():
+            file.write(self.encoder(record))
+            file.write(b'\n')
+
+    def write(self, record: Dict) -> None:
+        if self.error is not None:
+            raise self.error
+        self.queue.put(record)
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            self.queue.put(_DONE)
+            self.thread.join()
+
+        if self.error is not None and not self.aborted:
+            raise self.error
+
+
+def write_articles(
+    articles: Iterable,
+    file_path: Path,
+    output_format: str = 'json',
+    compression: Optional[str] = None,
+    encoder: Optional[Encoder] = None,
+) -> None:
+    "Write the ``as_dict()`` of each article to ``file_path``."
+    with ArticleWriter(file_path, output_format, compression, encoder) as writer:
+        for article in articles:
+            writer.write(article.as_dict())
+
+
+def article_record(article) -> Dict[str, Any]:
+    """Flatten an article from any scraper into the columns of the Parquet schema.
+
+    ``database`` is the scraper module the article came from; for CNKI the
+    site's own database (期刊, 博士, ...) goes to ``source_type``.
+    """
+    d = article.as_dict()
+    return {
+        'database': type(article).__module__,
+        'source_type': getattr(article, 'database', None),
+        'author': d.get('author'),
+        'title': d.get('title', d.get('caption')),
+        'publication': d.get('publication', d.get('publication/university')),
+        'date': getattr(article, 'date', None) or getattr(article, 'when', None),
+        'url': d.get('url'),
+        'download': d.get('download'),
+    }
+
+
+def article_schema(partition_by: Sequence[str] = ()) -> 'pa.Schema':
+    "Column types for exported articles; partition columns live in the directory names."
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    fields = [
+        ('database', dictionary),
+        ('source_type', dictionary),
+        ('author', pa.string()),
+        ('title', pa.string()),
+        ('publication', dictionary),
+        ('date', pa.date32()),
+        ('url', pa.string()),
+        ('download', pa.string()),
+    ]
+    return pa.schema([(name, type_) for name, type_ in fields if name not in partition_by])
+
+
+class ParquetArticleWriter:
+    """Accumulate articles into typed column batches and write them as Parquet row groups.
+
+    Without ``partition_by``, ``path`` is a single Parquet file. With
+    ``partition_by`` set to any of 'database' and 'year', ``path`` is a
+    directory laid out hive-style, e.g. ``path/database=cnki/year=2020/part-0.parquet``.
+    The file, or the whole directory, is written under a temporary name and
+    only replaces ``path`` on close, whether ``path`` was a file or a
+    directory before, so no stale partitions of an earlier run survive. If
+    anything fails, including close itself, the temporary output is removed.
+    Without any articles, an empty file with the schema is written.
+    """
+    PARTITIONS = ('database', 'year')
+
+    def __init__(
+        self,
+        path: Path,
+        batch_size: int = 10_000,
+        partition_by: Sequence[str] = (),
+        compression: Optional[str] = 'snappy',
+    ):
+        if pa is None:
+            raise RuntimeError('Parquet export requires the pyarrow package')
+        unknown = set(partition_by) - set(self.PARTITIONS)
+        if unknown:
+            raise ValueError(f'Unknown partition columns: {sorted(unknown)}')
+
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.partition_by = tuple(partition_by)
+        self.compression = compression
+        self.schema = article_schema(self.partition_by)
+        self.buffers: Dict[Tuple, List[Dict[str, Any]]] = {}
+        self.writers: Dict[Tuple, 'pq.ParquetWriter'] = {}
+
+        if self.partition_by:
+            self.staging = Path(tempfile.mkdtemp(
+                dir=self.path.parent, prefix=f'.{self.path.name}.', suffix='.tmp',
+            ))
+        else:
+            self.staging = self.path.with_name(f'.{self.path.name}.tmp')
+
+    def __enter__(self) -> 'ParquetArticleWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _partition_key(self, record: Dict[str, Any]) -> Tuple:
+        key = []
+        for column in self.partition_by:
+            if column == 'year':
+                key.append(record['date'].year if record['date'] else None)
+            else:
+                key.append(record.pop(column))
+        return tuple(key)
+
+    def _file_path(self, key: Tuple) -> Path:
+        if not self.partition_by:
+            return self.staging
+
+        directory = self.staging
+        for column, value in zip(self.partition_by, key):
+            value = '__HIVE_DEFAULT_PARTITION__' if value is None else value
+            directory = directory / f'{column}={value}'
+        return directory / 'part-0.parquet'
+
+    def _writer(self, key: Tuple) -> 'pq.ParquetWriter':
+        if key not in self.writers:
+            file_path = self._file_path(key)
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            self.writers[key] = pq.ParquetWriter(file_path, self.schema, compression=self.compression)
+        return self.writers[key]
+
+    def write(self, article) -> None:
+        record = article_record(article)
+        key = self._partition_key(record)
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(record)
+
+        if len(buffer) >= self.batch_size:
+            self._flush(key)
+
+    def _flush(self, key: Tuple) -> None:
+        records = self.buffers.pop(key, None)
+        if not records:
+            return
+
+        columns = {name: [r[name] for r in records] for name in self.schema.names}
+        batch = pa.RecordBatch.from_pydict(columns, schema=self.schema)
+        self._writer(key).write_batch(batch, row_group_size=self.batch_size)
+
+    def close(self) -> None:
+        try:
+            for key in list(self.buffers):
+                self._flush(key)
+
+            if not self.writers:
+                # Readers expect the path to exist; give them an empty table.
+                self._writer(())
+
+            for writer in self.writers.values():
+                writer.close()
+            self.writers.clear()
+
+            self._replace()
+        except BaseException:
+            self.abort()
+            raise
+
+    def _replace(self) -> None:
+        "Move the staged output to ``path``, replacing whatever is there."
+        if not (os.path.lexists(self.path) and (self.path.is_dir() or self.staging.is_dir())):
+            os.replace(self.staging, self.path)
+            return
+
+        # os.replace cannot swap a directory for a file or a non-empty
+        # directory; move the old output aside first.
+        old = Path(tempfile.mkdtemp(dir=self.path.parent, prefix=f'.{self.path.name}.', suffix='.old'))
+        old.rmdir()
+        os.replace(self.path, old)
+
+        try:
+            os.replace(self.staging, self.path)
+        except BaseException:
+            os.replace(old, self.path)
+            raise
+
+        _remove(old)
+
+    def abort(self) -> None:
+        self.buffers.clear()
+
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+        if os.path.lexists(self.staging):
+            _remove(self.staging)
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
+
+def write_parquet(
+    articles: Iterable,
+    path: Path,
+    batch_size: int = 10_000,
+    partition_by: Sequence[str] = (),
+    compression: Optional[str] = 'snappy',
+) -> None:
+    "Export articles from any scraper to Parquet."
+    with ParquetArticleWriter(path, batch_size, partition_by, compression) as writer:
+        for article in articles:
+            writer.write(article)
@@ -3,7 +3,6 @@ from itertools import count
 from typing import Dict, Iterable, Tuple, List
 
 from bs4 import BeautifulSoup
-from requests import post
 from datetime import date, datetime
 
 import json
@@ -11,6 +10,8 @@ import os
 import re
 import uuid
 
+import transport
+
 @dataclass
 class Result:
     author: str
@@ -71,7 +72,8 @@ def submit_query(keyword: str):
     print(f"關鍵字：「{keyword}」")
     query = {"searchword": keyword,
              "field": "content"}
-    with post('http://www.bsm.org.cn/pages.php?pagename=search', query) as resp:
+    with transport.session() as session, \
+            session.post('http://www.bsm.org.cn/pages.php?pagename=search', query) as resp:
         resp.raise_for_status()
         doc = BeautifulSoup(resp.text, 'html.parser')
         content = doc.find('div', class_='record_list_main')